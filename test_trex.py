@@ -0,0 +1,51 @@
+import os
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import trex
+from trex import pg
+
+
+@pytest.fixture(scope='module', autouse=True)
+def sprites():
+    cwd = os.getcwd()
+    os.chdir(Path(__file__).parent)
+    pg.init()
+    trex.init()
+    yield
+    os.chdir(cwd)
+    pg.quit()
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_timeline_plans_clear_every_obstacle(monkeypatch, seed):
+    plans = []
+    clear = trex.Timeline.clear
+
+    def record(self, frame, pattern, free):
+        plan = clear(self, frame, pattern, free)
+        if plan is not None:
+            plans.append(plan)
+        return plan
+
+    monkeypatch.setattr(trex.Timeline, 'clear', record)
+    engine = trex.Engine(trex.FixedClock(trex.FRAMERATE),
+                         trex.Screen(trex.SCREEN_SIZE, headless=True))
+    scene = trex.Gameplay(engine, seed=seed)
+
+    for _ in range(6000):
+        # the action is read on the update that advances to frame + 1
+        frame = scene.frame + 1
+        action = 'run'
+        for plan in plans:
+            if plan.action != 'run' and plan.start <= frame <= plan.end:
+                action = plan.action
+        scene.act(action)
+        scene.update(1000 // trex.FRAMERATE)
+        for sprite in scene.sprites:
+            if isinstance(sprite, (trex.Cactus, trex.Dactyl)):
+                assert not sprite.rect.colliderect(scene.dino.rect), (
+                    'frame %d: %s hit %s' % (scene.frame, scene.dino.state, sprite))
@@ -1,4 +1,5 @@
 import argparse
+import asyncio
 import contextlib
 import copy
 import json
@@ -8,6 +9,7 @@ import os
 import random
 from pathlib import Path
 
+from collections import namedtuple
 from itertools import cycle
 
 with contextlib.redirect_stdout(open(os.devnull, "w")):
@@ -17,6 +19,11 @@ SCENE_EVENT = pg.USEREVENT
 SCREEN_SIZE = (1024, 400)
 FRAMERATE = 60
 SCROLL_STEP = -6.0
+JUMP_STEP = 0.07
+JUMP_HEIGHT = 250
+#: height of the dino's feet above the floor for each frame after the jump key
+JUMP_ARC = (0,) + tuple(math.sin(JUMP_STEP * n) * JUMP_HEIGHT
+                        for n in range(1, math.ceil(math.pi / JUMP_STEP)))
 SPRITE_SHEET_FILENAME = 'images/sprites.png'
 SPRITE_SHEET = None
 SPRITE_CELLS_FILENAME = 'cells.json'
@@ -100,9 +107,10 @@ class MovingTile(ImageSprite):
     def __init__(self, image, *groups, position=None):
         super().__init__(image, *groups, position=position)
         self.x = self.rect.x
+        self.vx = SCROLL_STEP
 
     def update(self, dt):
-        self.x += SCROLL_STEP
+        self.x += self.vx
         self.rect.x = self.x
 
 
@@ -112,9 +120,9 @@ class GroundTile(MovingTile):
 
 class Cactus(MovingTile):
 
-    def __init__(self, *groups, position=None):
-        cells = SPRITE_CELLS['cacti'].values()
-        image = random.choice(tuple(cells))
+    def __init__(self, *groups, position=None, image=None):
+        if image is None:
+            image = random.choice(tuple(SPRITE_CELLS['cacti'].values()))
         super().__init__(image, *groups, position=position)
 
 
@@ -132,6 +140,119 @@ class Dactyl(MovingTile):
 
 EnemyClasses = [Cactus, Dactyl]
 
+Obstacle = namedtuple('Obstacle', 'frame kind name offset height')
+
+#: how to clear a pattern: hold `action` from frame `start` to `end`, the dino
+#: can act again on frame `free`
+Plan = namedtuple('Plan', 'action start end free')
+
+
+class Timeline:
+    """
+    Lazily generated stream of obstacles with rising speed. Every pattern is
+    checked against the jump arc and crouch hitbox before it is yielded, so
+    the stream is always clearable.
+    """
+
+    def __init__(self, right, dino, seed=None, minspeed=-SCROLL_STEP,
+                 maxspeed=12.0, ramp=FRAMERATE * 180):
+        #: x obstacles spawn at
+        self.right = right
+        #: dino's running rect
+        self.dino = dino.copy()
+        self.crouch = SPRITE_CELLS['trex']['crouch1'].get_rect(bottomleft=dino.bottomleft)
+        self.random = random.Random(seed)
+        self.minspeed = minspeed
+        self.maxspeed = maxspeed
+        self.ramp = ramp
+
+    def difficulty(self, frame):
+        return min(1.0, frame / self.ramp)
+
+    def speed(self, frame):
+        return self.minspeed + (self.maxspeed - self.minspeed) * self.difficulty(frame)
+
+    def pattern(self, difficulty):
+        cacti = SPRITE_CELLS['cacti']
+        kind = self.random.choices(
+            ['cactus', 'cacti', 'dactyl', 'stack'],
+            weights=[4 - 2 * difficulty, 1 + 2 * difficulty, 1, 2 * difficulty])[0]
+        if kind == 'cactus':
+            return [('cacti', self.random.choice(tuple(cacti)), 0, 0)]
+        if kind == 'cacti':
+            # adjacent cacti like the legacy Enemies.spawn
+            pattern = []
+            offset = 0
+            for _ in range(self.random.randint(2, 2 + round(difficulty))):
+                name = self.random.choice(tuple(cacti))
+                pattern.append(('cacti', name, offset, 0))
+                offset += cacti[name].get_width()
+            return pattern
+        height = self.dino.height - SPRITE_CELLS['dactyl']['flying1'].get_height() // 2
+        if kind == 'dactyl':
+            return [('dactyl', 'flying1', 0, self.random.choice([0, height]))]
+        # stack of dactyls at head height, crouch under them
+        step = SPRITE_CELLS['dactyl']['flying1'].get_height()
+        return [('dactyl', 'flying1', 0, height + step * n) for n in range(3)]
+
+    def windows(self, frame, pattern, width):
+        """
+        Yield (frame, bottom, top) for every frame an obstacle overlaps a dino
+        `width` wide.
+        """
+        for kind, name, offset, height in pattern:
+            image = SPRITE_CELLS[kind][name]
+            x = self.right + offset
+            t = frame
+            while x + image.get_width() > self.dino.left:
+                if x < self.dino.left + width:
+                    yield (t, height, height + image.get_height())
+                t += 1
+                x -= self.speed(t)
+
+    def clear(self, frame, pattern, free):
+        """
+        Return the Plan that clears `pattern` spawned at `frame` with the dino
+        free from frame `free`, or None if it cannot be cleared.
+        """
+        running = list(self.windows(frame, pattern, self.dino.width))
+        if not running:
+            return Plan('run', None, None, free)
+        first = min(t for t, _, _ in running)
+        last = max(t for t, _, _ in running)
+        if free <= first and all(bottom >= self.dino.height for _, bottom, _ in running):
+            return Plan('run', first, last, free)
+        crouching = list(self.windows(frame, pattern, self.crouch.width))
+        start = min(t for t, _, _ in crouching)
+        end = max(t for t, _, _ in crouching)
+        if (free <= start
+                and all(bottom >= self.crouch.height for _, bottom, _ in crouching)):
+            # standing up takes a frame before the dino can jump again
+            return Plan('crouch', start, end, end + 2)
+        for start in range(max(free, last - len(JUMP_ARC) + 1), first):
+            if all(JUMP_ARC[t - start] >= top
+                   or JUMP_ARC[t - start] + self.dino.height <= bottom
+                   for t, bottom, top in running):
+                return Plan('jump', start, start, start + len(JUMP_ARC) + 1)
+        return None
+
+    def __iter__(self):
+        frame = 0
+        free = 0
+        while True:
+            difficulty = self.difficulty(frame)
+            frame += round(self.random.choice([60, 75, 90, 120]) * (1 - difficulty / 2))
+            while True:
+                pattern = self.pattern(difficulty)
+                plan = self.clear(frame, pattern, free)
+                if plan is not None:
+                    break
+                # not clearable, give the dino more room and try again
+                frame += 5
+            free = plan.free
+            for kind, name, offset, height in pattern:
+                yield Obstacle(frame, kind, name, offset, height)
+
 class Sprite(pg.sprite.Sprite):
 
     def __init__(self, *groups, position=None):
@@ -273,10 +394,10 @@ class DinoRunning(DinoState):
         self.dino.animation = Animation([ cells['running1'], cells['running2'] ], repeat=8)
 
     def update(self):
-        keys = pg.key.get_pressed()
-        if keys[pg.K_DOWN]:
+        up, down = self.dino.pressed()
+        if down:
             return DinoCrouch(self.dino)
-        elif keys[pg.K_UP]:
+        elif up:
             return DinoJump(self.dino)
 
 
@@ -290,11 +411,11 @@ class DinoCrouch(DinoState):
         self.dino.rect = self.dino.animation.images[0].get_rect(bottomleft = self.dino.rect.bottomleft)
 
     def update(self):
-        keys = pg.key.get_pressed()
-        if not keys[pg.K_DOWN]:
+        up, down = self.dino.pressed()
+        if not down:
             self.dino.rect = self.restore
             return DinoRunning(self.dino)
-        elif keys[pg.K_UP]:
+        elif up:
             self.dino.rect = self.restore
             return DinoJump(self.dino)
 
@@ -307,8 +428,8 @@ class DinoJump(DinoState):
         self.dino.animation = Animation([ cells['jumping1'], cells['jumping2'] ], repeat=8)
         self.y = self.floor = self.dino.rect.bottom
         self.angle = 0
-        self.step = 0.07
-        self.height = 250
+        self.step = JUMP_STEP
+        self.height = JUMP_HEIGHT
 
     def update(self):
         self.angle += self.step
@@ -319,16 +440,26 @@ class DinoJump(DinoState):
         self.dino.rect.bottom = self.y
 
 
+ACTIONS = ('run', 'jump', 'crouch')
+
 class Dino(Sprite):
 
     def __init__(self, *groups, position=None):
         super().__init__(*groups)
+        #: one of ACTIONS, or None to read the keyboard
+        self.action = None
         self.state = DinoRunning(self)
         self.image = next(self.animation)
         if position is None:
             position = {}
         self.rect = self.image.get_rect(**position)
 
+    def pressed(self):
+        if self.action is None:
+            keys = pg.key.get_pressed()
+            return keys[pg.K_UP], keys[pg.K_DOWN]
+        return self.action == 'jump', self.action == 'crouch'
+
     def update(self, dt):
         newstate = self.state.update()
         if newstate:
@@ -549,17 +680,109 @@ class Clock:
     def tick(self):
         return self._clock.tick(self.framerate)
 
+    async def atick(self):
+        """
+        Like tick but awaits the rest of the frame instead of blocking.
+        """
+        elapsed = self._clock.tick()
+        await asyncio.sleep(max(0, 1000 / self.framerate - elapsed) / 1000)
+        return elapsed + self._clock.tick()
+
+
+class FixedClock:
+    """
+    Constant timestep that never waits, for sessions driven by an agent.
+    """
+
+    def __init__(self, framerate):
+        self.framerate = framerate
+
+    def tick(self):
+        return 1000 // self.framerate
+
+    async def atick(self):
+        await asyncio.sleep(0)
+        return self.tick()
+
+
+class View:
+    """
+    Map simulation coordinates onto a screen of any size. The atlas is scaled
+    once per target size and cached until the next resize, so drawing costs
+    no per-frame transforms.
+    """
+
+    def __init__(self, size, logical=SCREEN_SIZE):
+        #: the simulation rect; game logic only ever sees these coordinates
+        self.rect = pg.Rect((0, 0), logical)
+        self.scale = None
+        self._sheet = None
+        self._cache = {}
+        self.resize(size)
+
+    def resize(self, size):
+        scale = min(size[0] / self.rect.width, size[1] / self.rect.height)
+        self.offset = ((size[0] - round(self.rect.width * scale)) // 2,
+                       (size[1] - round(self.rect.height * scale)) // 2)
+        if scale != self.scale:
+            # evict everything scaled for the old size
+            self.scale = scale
+            self._sheet = None
+            self._cache.clear()
+        #: letterboxed area of the screen the simulation is drawn into
+        self.viewport = pg.Rect(self.offset, self.scaled(self.rect.size))
+
+    def scaled(self, size):
+        return tuple(round(n * self.scale) for n in size)
+
+    def point(self, pos):
+        x, y = pos
+        ox, oy = self.offset
+        return (ox + round(x * self.scale), oy + round(y * self.scale))
+
+    def image(self, image):
+        if self.scale == 1:
+            return image
+        if image not in self._cache:
+            self._cache[image] = self._scale_image(image)
+        return self._cache[image]
+
+    def _scale_image(self, image):
+        if image.get_parent() is SPRITE_SHEET:
+            # atlas cell, cut it from the scaled atlas
+            if self._sheet is None:
+                size = self.scaled(SPRITE_SHEET.get_size())
+                self._sheet = pg.transform.smoothscale(SPRITE_SHEET, size)
+            rect = pg.Rect(self.scaled(image.get_offset()), self.scaled(image.get_size()))
+            return self._sheet.subsurface(rect.clip(self._sheet.get_rect()))
+        return pg.transform.smoothscale(image, self.scaled(image.get_size()))
+
+    def draw(self, surface, sprites):
+        surface.blits([(self.image(sprite.image), self.point(sprite.rect.topleft))
+                       for sprite in sprites], doreturn=False)
+
 
 class Screen:
 
-    def __init__(self, size):
-        self.surface = pg.display.set_mode(size)
+    def __init__(self, size, headless=False):
+        #: offscreen sessions draw to a plain surface and take no events
+        self.headless = headless
+        if headless:
+            self.surface = pg.Surface(size)
+        else:
+            self.surface = pg.display.set_mode(size, pg.RESIZABLE)
         self.background = self.surface.copy()
-        self.rect = self.surface.get_rect()
+        self.view = View(size)
+        self.rect = self.view.rect
 
     def clear(self):
         self.surface.blit(self.background, (0, 0))
 
+    def resize(self, size):
+        self.surface = pg.display.get_surface()
+        self.background = pg.transform.scale(self.background, size)
+        self.view.resize(size)
+
 
 class Scene:
 
@@ -576,6 +799,9 @@ class Scene:
     def exit(self):
         pass
 
+    def act(self, action):
+        pass
+
     def update(self, dt):
         pass
 
@@ -613,7 +839,7 @@ class MainMenu(Scene):
         self.eventdispatch[pg.KEYDOWN] = self.on_keydown
 
     def draw(self, surface):
-        self.sprites.draw(surface)
+        self.engine.screen.view.draw(surface, self.sprites)
 
     def on_keydown(self, event):
         if event.key == pg.K_ESCAPE:
@@ -625,14 +851,90 @@ class MainMenu(Scene):
         self.sprites.update(dt)
 
 
+class SkyBand:
+    """
+    Horizontal band of clouds scrolled by offset. Clouds are pre-composited
+    into strips one band-width wide; a strip is culled once it scrolls off and
+    a new one is laid out, so a band is at most two blits.
+    """
+
+    def __init__(self, rect, factor, maxclouds):
+        self.rect = rect
+        self.factor = factor
+        self.maxclouds = maxclouds
+        self.offset = 0.0
+        #: [layout, composited image or None] pairs, left to right
+        self.strips = [[self.layout(), None], [self.layout(), None]]
+        self._scale = None
+
+    def layout(self):
+        cloud = SPRITE_CELLS['clouds']['cloud'].get_rect()
+        return tuple(
+            (random.randint(0, self.rect.width - cloud.width),
+             random.randint(0, max(0, self.rect.height - cloud.height)))
+            for _ in range(random.randint(0, self.maxclouds)))
+
+    def composite(self, strip, view):
+        image = Surface(view.scaled(self.rect.size))
+        cloud = view.image(SPRITE_CELLS['clouds']['cloud'])
+        image.blits([(cloud, view.scaled(pos)) for pos in strip], doreturn=False)
+        return image
+
+    def update(self, dt, speed):
+        self.offset += speed * self.factor
+        if self.offset >= self.rect.width:
+            self.offset -= self.rect.width
+            self.strips.pop(0)
+            self.strips.append([self.layout(), None])
+
+    def draw(self, surface, view):
+        if view.scale != self._scale:
+            self._scale = view.scale
+            for strip in self.strips:
+                strip[1] = None
+        for index, strip in enumerate(self.strips):
+            layout, image = strip
+            if not layout:
+                continue
+            if image is None:
+                image = strip[1] = self.composite(layout, view)
+            x = self.rect.x + index * self.rect.width - self.offset
+            surface.blit(image, view.point((x, self.rect.y)))
+
+
+class Parallax:
+    """
+    Sky made of stacked bands, farther (higher) bands scroll slower.
+    """
+
+    def __init__(self, rect, nbands=3, maxclouds=3):
+        height = rect.height // nbands
+        self.bands = [
+            SkyBand(pg.Rect(rect.x, rect.y + height * index, rect.width, height),
+                    factor=(index + 1) / (nbands + 1), maxclouds=maxclouds)
+            for index in range(nbands)
+        ]
+
+    def update(self, dt, speed=-SCROLL_STEP):
+        for band in self.bands:
+            band.update(dt, speed)
+
+    def draw(self, surface, view):
+        for band in self.bands:
+            band.draw(surface, view)
+
+
 class Gameplay(Scene):
 
-    def __init__(self, engine):
+    def __init__(self, engine, seed=None):
         super().__init__(engine)
         self.eventdispatch[pg.KEYDOWN] = self.on_keydown
         self.sprites = pg.sprite.Group()
         self.dino = Dino(position=dict(bottomleft=(200, 350)))
         self.floor = self.dino.rect.bottom
+        screen = self.engine.screen.rect
+        self.sky = Parallax(pg.Rect(screen.left, screen.top,
+                                    screen.width, screen.centery - 50 - screen.top))
         self.sprites.add(self.dino)
         x = 0
         tiles = tuple(SPRITE_CELLS['ground'].values())
@@ -641,14 +943,26 @@ class Gameplay(Scene):
             sprite = GroundTile(random.choice(tiles), position=dict(x=x, top=self.floor))
             self.sprites.add(sprite)
             x += sprite.rect.width
-        self.spawn = 0
-        self.reset_spawn()
-
-    def reset_spawn(self):
-        self.spawn = random.choice([60, 75, 90, 120])
+        self.frame = 0
+        self.timeline = Timeline(self.engine.screen.rect.right, self.dino.rect, seed=seed)
+        self.obstacles = iter(self.timeline)
+        self.pending = next(self.obstacles)
+        self.act(None)
+
+    def spawn(self, obstacle):
+        position = dict(left=self.engine.screen.rect.right + obstacle.offset,
+                        bottom=self.floor - obstacle.height)
+        if obstacle.kind == 'dactyl':
+            sprite = Dactyl(position=position)
+        else:
+            image = SPRITE_CELLS[obstacle.kind][obstacle.name]
+            sprite = Cactus(position=position, image=image)
+        sprite.vx = -self.timeline.speed(self.frame)
+        self.sprites.add(sprite)
 
     def draw(self, surface):
-        self.sprites.draw(surface)
+        self.sky.draw(surface, self.engine.screen.view)
+        self.engine.screen.view.draw(surface, self.sprites)
 
     def draw_rects(self):
         for sprite in self.sprites:
@@ -659,7 +973,21 @@ class Gameplay(Scene):
             pg.event.post(pg.event.Event(pg.QUIT))
             self.engine.scene = MainMenu(self.engine)
 
+    def act(self, action):
+        if action is None and self.engine.screen.headless:
+            # the keyboard is shared by every session, never read it headless
+            action = 'run'
+        if action is not None and action not in ACTIONS:
+            raise ValueError('unknown action %r, expected one of %s' % (action, ACTIONS))
+        self.dino.action = action
+
     def update(self, dt):
+        self.frame += 1
+        speed = self.timeline.speed(self.frame)
+        for sprite in self.sprites:
+            if isinstance(sprite, MovingTile):
+                sprite.vx = -speed
+        self.sky.update(dt, speed)
         self.sprites.update(dt)
         groundtiles = tuple(sprite for sprite in self.sprites if isinstance(sprite, GroundTile))
         right = max(tile.rect.right for tile in groundtiles)
@@ -667,12 +995,13 @@ class Gameplay(Scene):
             if tile.rect.right < self.engine.screen.rect.left:
                 tile.rect.left = right
                 tile.x = tile.rect.x
-        self.spawn -= 1
-        if self.spawn == 0:
-            class_ = random.choice(EnemyClasses)
-            position = dict(left = self.engine.screen.rect.right, bottom = self.floor)
-            self.sprites.add(class_(position=position))
-            self.reset_spawn()
+        for sprite in self.sprites:
+            if (isinstance(sprite, (Cactus, Dactyl))
+                    and sprite.rect.right < self.engine.screen.rect.left):
+                sprite.kill()
+        while self.pending.frame <= self.frame:
+            self.spawn(self.pending)
+            self.pending = next(self.obstacles)
 
 
 class Engine:
@@ -691,20 +1020,62 @@ class Engine:
             self.step()
 
     def step(self):
-        dt = self.clock.tick()
-        for event in pg.event.get():
-            if event.type in self._scene.eventdispatch:
-                self._scene.eventdispatch[event.type](event)
+        self.advance(self.clock.tick())
+
+    def advance(self, dt):
+        if not self.screen.headless:
+            for event in pg.event.get():
+                if event.type == pg.VIDEORESIZE:
+                    self.screen.resize(event.size)
+                if event.type in self._scene.eventdispatch:
+                    self._scene.eventdispatch[event.type](event)
         self._scene.update(dt)
         self.screen.clear()
+        self.screen.surface.set_clip(self.screen.view.viewport)
         self._scene.draw(self.screen.surface)
-        pg.display.flip()
+        self.screen.surface.set_clip(None)
+        if not self.screen.headless:
+            pg.display.flip()
         if self.scene is not self._scene:
             self._scene.exit()
             self._scene = self.scene
             self._scene.enter()
 
 
+class AsyncEngine(Engine):
+    """
+    Engine stepped from an asyncio event loop. Each frame yields to the loop,
+    so many headless sessions can share one loop and be fed actions from
+    batched policy calls.
+    """
+
+    def __init__(self, clock, screen):
+        super().__init__(clock, screen)
+        self.running = False
+
+    async def run(self, scene, policy=None):
+        """
+        Step until stopped or, with a display, until QUIT. `policy` is an
+        async callable taking this engine and returning an action.
+        """
+        self._scene = self.scene = scene
+        self.running = True
+        while self.running:
+            if not self.screen.headless and pg.event.peek(pg.QUIT):
+                break
+            action = None if policy is None else await policy(self)
+            await self.astep(action)
+
+    async def astep(self, action=None):
+        dt = await self.clock.atick()
+        self._scene.act(action)
+        self.advance(dt)
+        return self._scene
+
+    def stop(self):
+        self.running = False
+
+
 def main(argv=None):
     """
     T-Rex Rush in Pygame.
@@ -716,6 +1087,7 @@ def main(argv=None):
     parser.add_argument('--debug', action='store_true', help='Debug logging [%(default)s].')
     parser.add_argument('--framerate', type=int, default=FRAMERATE, help='Framerate [%(default)s].')
     parser.add_argument('--screen', type=sizetype, default=SCREEN_SIZE, help='Screen size [%(default)s].')
+    parser.add_argument('--async', dest='async_', action='store_true', help='Run on an asyncio event loop [%(default)s].')
     args = parser.parse_args(argv)
 
     if args.debug:
@@ -728,11 +1100,17 @@ def main(argv=None):
     clock = Clock(args.framerate)
     screen = Screen(args.screen)
     screen.background.fill((200,200,200))
-    engine = Engine(clock, screen)
+    if args.async_:
+        engine = AsyncEngine(clock, screen)
+    else:
+        engine = Engine(clock, screen)
 
     scene = MainMenu(engine)
     scene = Gameplay(engine)
-    engine.run(scene)
+    if args.async_:
+        asyncio.run(engine.run(scene))
+    else:
+        engine.run(scene)
 
 if __name__ == '__main__':
     main()